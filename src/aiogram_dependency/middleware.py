@@ -1,9 +1,8 @@
-from contextlib import AsyncExitStack
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
 from typing import Callable, Dict, Any, Awaitable, Optional
 from aiogram.types import TelegramObject
 from .registry import DependencyRegistry
-from .resolver import DependencyResolver
+from .resolver import DependencyResolver, ResolveContext
 
 
 class DependencyMiddleware(BaseMiddleware):
@@ -18,8 +17,9 @@ class DependencyMiddleware(BaseMiddleware):
         data: Dict[str, Any],
     ):
         # Resolve dependencies and update data dict
-        async with AsyncExitStack() as exit_stack:
-            data = await self.resolver.resolve_dependencies(event, data.copy(), exit_stack)
+        ctx = ResolveContext()
+        async with ctx.exit_stack:
+            data = await self.resolver.resolve_dependencies(event, data.copy(), ctx)
             # Reset request registry cache after each request to enshure that some connections return to pool (for example sqlalchemy session)
             self.registry.reset_request_cache()
             return await handler(event, data)
@@ -1,32 +1,54 @@
-from typing import Dict, Any
+import functools
+from types import MappingProxyType
+from typing import Callable, Dict, Any, Tuple
 from aiogram.types import TelegramObject
 from .dependency import Dependency, Scope
 
+# Returned by get_dependency on a cache miss, so cached None values still count as hits
+MISSING: Any = object()
+
+# Request cache keys are (kind, id) tuples, cheaper to build and hash than formatted strings
+CacheKey = Tuple[int, int]
+USER_KEY = 1
+CHAT_KEY = 2
+GLOBAL_CACHE_KEY: CacheKey = (0, 0)
+_EMPTY_CACHE = MappingProxyType({})
+# Overriding any of these disables the closures returned by DependencyRegistry.bind()
+_STORAGE_METHODS = (
+    "get_dependency",
+    "set_dependency",
+    "reset_request_cache",
+    "reset_singletone_cache",
+)
+
 
 class DependencyRegistry:
     def __init__(self):
-        self._singleton_cache: Dict[int, Any] = {}
-        self._request_cache: Dict[str, Dict[int, Any]] = {}
-
-    def get_cache_key(self, event: TelegramObject) -> str:
-        if hasattr(event, "from_user") and event.from_user:
-            return f"user_{event.from_user.id}"
-        elif hasattr(event, "chat") and event.chat:
-            return f"chat_{event.chat.id}"
-        else:
-            return "global"
+        # Keyed by the dependency callable itself, the dict hashes it once per lookup
+        self._singleton_cache: Dict[Callable, Any] = {}
+        self._request_cache: Dict[CacheKey, Dict[Callable, Any]] = {}
 
-    def get_dependency(self, dependency: Dependency, cache_key: str):
-        dep_key = hash(dependency.dependency)
+    def get_cache_key(self, event: TelegramObject) -> CacheKey:
+        # Checked per instance, TelegramObject allows extra fields so types don't decide this
+        from_user = getattr(event, "from_user", None)
+        if from_user:
+            return (USER_KEY, from_user.id)
+        chat = getattr(event, "chat", None)
+        if chat:
+            return (CHAT_KEY, chat.id)
+        return GLOBAL_CACHE_KEY
+
+    def get_dependency(self, dependency: Dependency, cache_key: CacheKey):
+        dep_key = dependency.dependency
         if dependency.scope == Scope.SINGLETON:
-            return self._singleton_cache.get(dep_key)
+            return self._singleton_cache.get(dep_key, MISSING)
         elif dependency.scope == Scope.REQUEST:
-            return self._request_cache.get(cache_key, {}).get(dep_key)
+            return self._request_cache.get(cache_key, _EMPTY_CACHE).get(dep_key, MISSING)
         else:
-            return None
+            return MISSING
 
-    def set_dependency(self, dependency: Dependency, value: Any, cache_key: str):
-        dep_key = hash(dependency.dependency)
+    def set_dependency(self, dependency: Dependency, value: Any, cache_key: CacheKey):
+        dep_key = dependency.dependency
         if dependency.scope == Scope.SINGLETON:
             self._singleton_cache[dep_key] = value
         elif dependency.scope == Scope.REQUEST:
@@ -34,8 +56,58 @@ class DependencyRegistry:
                 self._request_cache[cache_key] = {}
             self._request_cache[cache_key][dep_key] = value
 
+    def bind(
+        self, dependency: Dependency
+    ) -> Tuple[Callable[[CacheKey], Any], Callable[[Any, CacheKey], None]]:
+        """Return (get, set) cache accessors specialized for the dependency scope"""
+        registry_type = type(self)
+        if any(
+            getattr(registry_type, name) is not getattr(DependencyRegistry, name)
+            for name in _STORAGE_METHODS
+        ):
+            # Subclasses with their own storage or reset logic may swap the cache dicts,
+            # so they keep going through their accessors
+            return (
+                functools.partial(self.get_dependency, dependency),
+                functools.partial(self.set_dependency, dependency),
+            )
+
+        dep_key = dependency.dependency
+        if dependency.scope == Scope.SINGLETON:
+            singleton_cache = self._singleton_cache
+
+            def get_singleton(cache_key: CacheKey):
+                return singleton_cache.get(dep_key, MISSING)
+
+            def set_singleton(value: Any, cache_key: CacheKey):
+                singleton_cache[dep_key] = value
+
+            return get_singleton, set_singleton
+        elif dependency.scope == Scope.REQUEST:
+            request_cache = self._request_cache
+
+            def get_request(cache_key: CacheKey):
+                return request_cache.get(cache_key, _EMPTY_CACHE).get(dep_key, MISSING)
+
+            def set_request(value: Any, cache_key: CacheKey):
+                if cache_key not in request_cache:
+                    request_cache[cache_key] = {}
+                request_cache[cache_key][dep_key] = value
+
+            return get_request, set_request
+        else:
+
+            def get_transient(cache_key: CacheKey):
+                return MISSING
+
+            def set_transient(value: Any, cache_key: CacheKey):
+                pass
+
+            return get_transient, set_transient
+
+    # Caches are cleared in place, accessors returned by bind() keep references to them
     def reset_request_cache(self):
-        self._request_cache = {}
+        self._request_cache.clear()
 
     def reset_singletone_cache(self):
-        self._singleton_cache = {}
+        self._singleton_cache.clear()
@@ -1,113 +1,485 @@
-from contextlib import AsyncExitStack
+import asyncio
 import inspect
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
 from typing import (
+    Callable,
     Dict,
     Any,
+    List,
+    Tuple,
 )
-from .dependency import Dependency
-from .registry import DependencyRegistry
+import weakref
+from weakref import WeakKeyDictionary
+from .dependency import Dependency, Scope
+from .registry import MISSING, CacheKey, DependencyRegistry
 from aiogram.types import TelegramObject
 from aiogram_dependency.utils import (
-    extract_handler_signature,
+    contextmanager_in_threadpool,
+    extract_handler_callback,
     extract_dependency,
+    get_signature,
     is_async_gen_callable,
     is_coroutine_callable,
     is_gen_callable,
-    solve_generator,
     run_in_threadpool,
 )
 
+__all__ = ["DepNode", "DependencyResolver", "HandlerPlan", "ResolveContext"]
+
+EVENT_PARAM_NAMES = ("event", "message", "callback")
+
+# How a dependency callable has to be invoked, computed once per plan node
+COROUTINE = 0
+ASYNC_GEN = 1
+GEN = 2
+PLAIN = 3
+# Kinds that run on the event loop and can overlap, sync kinds go through worker threads
+CONCURRENT_KINDS = (COROUTINE, ASYNC_GEN)
+
+# Parameter kinds that can be passed positionally
+POSITIONAL_KINDS = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+# *args and **kwargs are never filled by the resolver
+VARIADIC_KINDS = (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD)
+
+# Where a dependency argument takes its value from
+EVENT_SLOT = 0
+DATA_SLOT = 1
+# data[name] when present, otherwise the parameter default is kept
+DATA_KEY_SLOT = 2
+# data[name] when present, otherwise an earlier handler dependency with the same name
+PASSTHROUGH_SLOT = 3
+RESULT_SLOT = 4
+# Slots whose ref is an index into the per-update results list
+REF_SLOTS = (PASSTHROUGH_SLOT, RESULT_SLOT)
+
+
+@dataclass(eq=False)
+class DepNode:
+    dependency: Dependency
+    kind: int
+    # Dependency callable, already wrapped into a context manager factory for generators
+    call: Callable[..., Any]
+    # Position of the resolved value in the per-update results list
+    index: int
+    # (param_name, slot, ref), ref is a results index for RESULT_SLOT and PASSTHROUGH_SLOT.
+    # Positional-only parameters and leading ones that always get a value are passed
+    # positionally, the rest by keyword
+    arg_plan: List[Tuple[str, int, Any]]
+    kwarg_plan: List[Tuple[str, int, Any]]
+    # Results indices of nested dependencies, skipped when this node is cached
+    requires: List[int]
+    # Registry accessors already specialized for the dependency scope
+    get_cached: Callable[[CacheKey], Any]
+    set_cached: Callable[[Any, CacheKey], None]
+
+
+@dataclass(eq=False)
+class HandlerPlan:
+    # Dependency nodes in topological order, nested dependencies first
+    order: List[DepNode] = field(default_factory=list)
+    # The same nodes grouped into levels, nodes of one level don't depend on each other
+    levels: List[List[DepNode]] = field(default_factory=list)
+    # (param_name, results index) for every handler dependency parameter
+    outputs: List[Tuple[str, int]] = field(default_factory=list)
+    size: int = 0
+
+    def reserve(self) -> int:
+        self.size += 1
+        return self.size - 1
+
+
+@dataclass(eq=False)
+class ResolveContext:
+    """Mutable state of a single resolve call, never shared between updates"""
+
+    # Closed once after the handler, tearing generator dependencies down in LIFO order
+    exit_stack: AsyncExitStack = field(default_factory=AsyncExitStack)
+
+
+def build_args(
+    arg_plan: List[Tuple[str, int, Any]],
+    event: TelegramObject,
+    data: Dict[str, Any],
+    results: List[Any],
+    # Bound as defaults so the loop reads locals instead of module globals
+    _result_slot: int = RESULT_SLOT,
+    _event_slot: int = EVENT_SLOT,
+    _data_slot: int = DATA_SLOT,
+    _data_key_slot: int = DATA_KEY_SLOT,
+    _missing: Any = MISSING,
+) -> List[Any]:
+    args = []
+    for param_name, slot, ref in arg_plan:
+        if slot == _result_slot:
+            args.append(results[ref])
+        elif slot == _event_slot:
+            args.append(event)
+        elif slot == _data_slot:
+            args.append(data)
+        elif slot == _data_key_slot:
+            # Only positional-only parameters get here, ref holds their default or MISSING
+            value = data.get(param_name, ref)
+            if value is _missing:
+                raise TypeError(
+                    f"No value in handler data for positional-only parameter '{param_name}'"
+                )
+            args.append(value)
+        else:
+            args.append(data.get(param_name, results[ref]))
+    return args
+
+
+def build_kwargs(
+    kwarg_plan: List[Tuple[str, int, Any]],
+    event: TelegramObject,
+    data: Dict[str, Any],
+    results: List[Any],
+    # Bound as defaults so the loop reads locals instead of module globals
+    _result_slot: int = RESULT_SLOT,
+    _data_key_slot: int = DATA_KEY_SLOT,
+    _event_slot: int = EVENT_SLOT,
+    _data_slot: int = DATA_SLOT,
+    _missing: Any = MISSING,
+) -> Dict[str, Any]:
+    kwargs = {}
+    for param_name, slot, ref in kwarg_plan:
+        if slot == _result_slot:
+            kwargs[param_name] = results[ref]
+        elif slot == _data_key_slot:
+            value = data.get(param_name, _missing)
+            if value is not _missing:
+                kwargs[param_name] = value
+        elif slot == _event_slot:
+            kwargs[param_name] = event
+        elif slot == _data_slot:
+            kwargs[param_name] = data
+        else:
+            kwargs[param_name] = data.get(param_name, results[ref])
+    return kwargs
+
+
+def _group_levels(order: List[DepNode]) -> List[List[DepNode]]:
+    # A node sits one level above the deepest node whose result it reads
+    level_of: Dict[int, int] = {}
+    levels: List[List[DepNode]] = []
+    for node in order:
+        level = 0
+        for _, slot, ref in node.arg_plan + node.kwarg_plan:
+            if slot in REF_SLOTS and ref in level_of:
+                level = max(level, level_of[ref] + 1)
+        level_of[node.index] = level
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(node)
+    return levels
+
+
+def _call_kind(dep_callable: Callable[..., Any]) -> Tuple[int, Callable[..., Any]]:
+    if is_gen_callable(dep_callable):
+        return GEN, contextmanager(dep_callable)
+    if is_async_gen_callable(dep_callable):
+        return ASYNC_GEN, asynccontextmanager(dep_callable)
+    if is_coroutine_callable(dep_callable):
+        return COROUTINE, dep_callable
+    return PLAIN, dep_callable
+
+
+def _positional_params(signature: inspect.Signature) -> List[Tuple[str, Any]]:
+    return [
+        (name, param.kind)
+        for name, param in signature.parameters.items()
+        if param.kind in POSITIONAL_KINDS
+    ]
+
+
+def _accepts_positional(dep_callable: Callable[..., Any]) -> bool:
+    # inspect.signature follows __wrapped__, but the wrapper is what actually gets called
+    if not hasattr(dep_callable, "__wrapped__"):
+        return True
+    try:
+        wrapper_signature = inspect.signature(dep_callable, follow_wrapped=False)
+    except (TypeError, ValueError):
+        return False
+    return _positional_params(wrapper_signature) == _positional_params(get_signature(dep_callable))
+
 
 class DependencyResolver:
     def __init__(self, registry: DependencyRegistry):
         self.registry = registry
-        self._resolving: set = set()
+        self._handler_plans: WeakKeyDictionary[Callable, HandlerPlan] = WeakKeyDictionary()
+        # aiogram HandlerObject is an unhashable dataclass, so its plans are kept by id()
+        self._handler_object_plans: Dict[int, Tuple[weakref.ref, HandlerPlan]] = {}
+        self._callers = (
+            self._call_coroutine,
+            self._call_async_gen,
+            self._call_gen,
+            self._call_plain,
+        )
+
+    def get_plan(self, func: Callable[..., Any]) -> HandlerPlan:
+        try:
+            plan = self._handler_plans.get(func)
+        except TypeError:
+            # Callable can't be weakly referenced, so build the plan every time
+            return self._build_plan(func)
+        if plan is None:
+            plan = self._build_plan(func)
+            self._handler_plans[func] = plan
+        return plan
+
+    def _get_handler_plan(self, data: Dict[str, Any]) -> HandlerPlan:
+        handler = data.get("handler")
+        handler_id = id(handler)
+        entry = self._handler_object_plans.get(handler_id)
+        # The weak reference check guards against id() reuse by a new object
+        if entry is not None and entry[0]() is handler:
+            return entry[1]
+
+        plan = self.get_plan(extract_handler_callback(data))
+        try:
+            handler_ref = weakref.ref(
+                handler, lambda _: self._handler_object_plans.pop(handler_id, None)
+            )
+        except TypeError:
+            # Handler can't be weakly referenced, so go through the callback every time
+            return plan
+        self._handler_object_plans[handler_id] = (handler_ref, plan)
+        return plan
+
+    def _build_plan(self, func: Callable[..., Any]) -> HandlerPlan:
+        plan = HandlerPlan()
+        # Non-transient nodes are shared by (callable, scope) inside the plan
+        shared: Dict[Tuple[int, str], DepNode] = {}
+        # Handler dependencies resolved so far, visible to later dependencies by name
+        resolved_names: Dict[str, int] = {}
+        for param_name, param in get_signature(func).parameters.items():
+            dependency = extract_dependency(param)
+            if dependency is None:
+                continue
+            # If dependency inside Dependency class empty the reserved result stays None
+            if dependency.dependency is None:
+                index = plan.reserve()
+            else:
+                index = self._build_node(dependency, plan, shared, resolved_names, {}).index
+            plan.outputs.append((param_name, index))
+            resolved_names[param_name] = index
+        plan.levels = _group_levels(plan.order)
+        return plan
+
+    def _build_node(
+        self,
+        dependency: Dependency,
+        plan: HandlerPlan,
+        shared: Dict[Tuple[int, str], DepNode],
+        resolved_names: Dict[str, int],
+        path: Dict[Tuple[int, str], Callable[..., Any]],
+    ) -> DepNode:
+        dep_callable = dependency.dependency
+        node_key = (id(dep_callable), dependency.scope)
+        # The graph is static, so cycles are rejected once here instead of on every update
+        if node_key in path:
+            keys = list(path)
+            cycle = [path[key] for key in keys[keys.index(node_key) :]] + [dep_callable]
+            names = " -> ".join(getattr(call, "__name__", repr(call)) for call in cycle)
+            raise ValueError(f"Circular dependency detected: {names}")
+
+        # Transient dependencies get a node per occurrence, so each one is called separately
+        is_shared = dependency.scope != Scope.TRANSIENT
+        if is_shared and node_key in shared:
+            return shared[node_key]
+
+        path[node_key] = dep_callable
+        arg_plan = []
+        kwarg_plan = []
+        requires = []
+        # A wrapper with a different positional signature gets every argument by keyword
+        positional = _accepts_positional(dep_callable)
+        for param_name, param in get_signature(dep_callable).parameters.items():
+            if param.kind in VARIADIC_KINDS:
+                continue
+
+            nested_dependency = extract_dependency(param)
+            if nested_dependency is None:
+                if param_name in EVENT_PARAM_NAMES:
+                    entry = (param_name, EVENT_SLOT, None)
+                elif param_name == "data":
+                    entry = (param_name, DATA_SLOT, None)
+                elif param_name in resolved_names:
+                    entry = (param_name, PASSTHROUGH_SLOT, resolved_names[param_name])
+                elif param.kind == inspect.Parameter.POSITIONAL_ONLY:
+                    # Can't be passed by keyword, so it carries its default for build_args
+                    default = MISSING if param.default is param.empty else param.default
+                    entry = (param_name, DATA_KEY_SLOT, default)
+                else:
+                    entry = (param_name, DATA_KEY_SLOT, None)
+            elif nested_dependency.dependency is None:
+                entry = (param_name, RESULT_SLOT, plan.reserve())
+            else:
+                nested_index = self._build_node(
+                    nested_dependency, plan, shared, resolved_names, path
+                ).index
+                requires.append(nested_index)
+                entry = (param_name, RESULT_SLOT, nested_index)
+
+            # Once one parameter goes by keyword, all following ones have to as well.
+            # Positional-only parameters come first and never go by keyword
+            if positional and (
+                param.kind == inspect.Parameter.POSITIONAL_ONLY
+                or (not kwarg_plan and param.kind in POSITIONAL_KINDS and entry[1] != DATA_KEY_SLOT)
+            ):
+                arg_plan.append(entry)
+            else:
+                kwarg_plan.append(entry)
+        del path[node_key]
+
+        # Appending after the nested dependencies keeps plan.order topological
+        kind, call = _call_kind(dep_callable)
+        get_cached, set_cached = self.registry.bind(dependency)
+        node = DepNode(
+            dependency,
+            kind,
+            call,
+            plan.reserve(),
+            arg_plan,
+            kwarg_plan,
+            requires,
+            get_cached,
+            set_cached,
+        )
+        plan.order.append(node)
+        if is_shared:
+            shared[node_key] = node
+        return node
 
     async def resolve_dependencies(
         self,
         event: TelegramObject,
         data: Dict[str, Any],
-        exit_stack: AsyncExitStack,
+        ctx: ResolveContext,
     ):
-        signature = extract_handler_signature(data)
+        plan = self._get_handler_plan(data)
         cache_key = self.registry.get_cache_key(event)
-        resolved_deps = {}
-        for param_name, param in signature.parameters.items():
-            dependency = extract_dependency(param)
-            if dependency:
-                # If dependency inside Dependency class empty just skip
-                if dependency.dependency is None:
-                    resolved_deps[param_name] = None
-                    continue
+        results = [None] * plan.size
+        missing = MISSING
+
+        # Walk consumers first, so nested dependencies of cached nodes are never resolved
+        needed = [False] * plan.size
+        pending = [False] * plan.size
+        for _, index in plan.outputs:
+            needed[index] = True
+        for node in reversed(plan.order):
+            if not needed[node.index]:
+                continue
+            cached_value = node.get_cached(cache_key)
+            if cached_value is not missing:
+                results[node.index] = cached_value
+                continue
+            pending[node.index] = True
+            for index in node.requires:
+                needed[index] = True
 
-                if dependency.dependency in self._resolving:
-                    raise ValueError(
-                        f"Circular dependency detected: {dependency.dependency.__name__}"
+        # Then call the remaining nodes level by level, overlapping independent async ones
+        for level in plan.levels:
+            concurrent = []
+            for node in level:
+                if not pending[node.index]:
+                    continue
+                if node.kind in CONCURRENT_KINDS:
+                    concurrent.append(node)
+                else:
+                    # Sync siblings run one at a time, they may share a parent that isn't thread-safe
+                    results[node.index] = await self._invoke(
+                        node, event, data, results, cache_key, ctx
                     )
-                # Call main resolver
-                resolved_value = await self._resolve_single_dep(
-                    dependency,
-                    event,
-                    data,
-                    cache_key,
-                    resolved_deps,
-                    exit_stack,
+            if not concurrent:
+                continue
+            if len(concurrent) == 1:
+                node = concurrent[0]
+                results[node.index] = await self._invoke(node, event, data, results, cache_key, ctx)
+                continue
+            outcomes = await asyncio.gather(
+                *(
+                    self._invoke_outcome(node, event, data, results, cache_key, ctx)
+                    for node in concurrent
                 )
-                resolved_deps[param_name] = resolved_value
+            )
+            # Every sibling has finished by now, so nothing enters the exit stack after it closes
+            for node, (ok, resolved_value) in zip(concurrent, outcomes):
+                if not ok:
+                    raise resolved_value
+                results[node.index] = resolved_value
 
-        data.update(resolved_deps)
+        for param_name, index in plan.outputs:
+            data[param_name] = results[index]
         return data
 
-    async def _resolve_single_dep(
+    async def _invoke(
         self,
-        dependency: Dependency,
+        node: DepNode,
         event: TelegramObject,
         data: Dict[str, Any],
-        cache_key: str,
-        resolved_deps: Dict[str, Any],
-        exit_stack: AsyncExitStack,
+        results: List[Any],
+        cache_key: CacheKey,
+        ctx: ResolveContext,
     ):
-        cached_value = self.registry.get_dependency(dependency, cache_key)
-        if cached_value is not None:
-            return cached_value
-
-        dep_callable = dependency.dependency
-        self._resolving.add(dep_callable)
+        dependency_args = build_args(node.arg_plan, event, data, results)
+        dependency_kwargs = build_kwargs(node.kwarg_plan, event, data, results)
+        resolved_value = await self._callers[node.kind](
+            node.call, dependency_args, dependency_kwargs, ctx
+        )
+        node.set_cached(resolved_value, cache_key)
+        return resolved_value
 
+    async def _invoke_outcome(
+        self,
+        node: DepNode,
+        event: TelegramObject,
+        data: Dict[str, Any],
+        results: List[Any],
+        cache_key: CacheKey,
+        ctx: ResolveContext,
+    ) -> Tuple[bool, Any]:
+        # Errors are returned as (False, error), so a dependency may return exception objects
         try:
-            dependency_signature = inspect.signature(dep_callable)
-            dependency_kwargs = {}
-            nested_dependencies = set()
-            for param_name, param in dependency_signature.parameters.items():
-                # Set default values to handler
-                if param_name in ["event", "message", "callback"]:
-                    dependency_kwargs[param_name] = event
-                elif param_name == "data":
-                    dependency_kwargs[param_name] = data
-                elif param_name in data:
-                    dependency_kwargs[param_name] = data[param_name]
-                elif param_name in resolved_deps:
-                    dependency_kwargs[param_name] = resolved_deps[param_name]
-
-                # Check if param is nested dependency and try resolve it
-                nested_dependency = extract_dependency(param)
-                if nested_dependency:
-                    nested_dependencies.add(nested_dependency.dependency)
-                    resolved_nested = await self._resolve_single_dep(
-                        nested_dependency, event, data, cache_key, resolved_deps, exit_stack
-                    )
-                    dependency_kwargs[param_name] = resolved_nested
+            return True, await self._invoke(node, event, data, results, cache_key, ctx)
+        except Exception as error:
+            return False, error
 
-            if is_gen_callable(dep_callable) or is_async_gen_callable(dep_callable):
-                resolved_value = await solve_generator(
-                    call=dep_callable, stack=exit_stack, kwargs=dependency_kwargs
-                )
-            elif is_coroutine_callable(dep_callable):
-                resolved_value = await dep_callable(**dependency_kwargs)
-            else:
-                resolved_value = await run_in_threadpool(dep_callable, **dependency_kwargs)
+    async def _call_coroutine(
+        self,
+        call: Callable[..., Any],
+        args: List[Any],
+        kwargs: Dict[str, Any],
+        ctx: ResolveContext,
+    ):
+        return await call(*args, **kwargs)
 
-            self.registry.set_dependency(dependency, resolved_value, cache_key)
-            return resolved_value
-        finally:
-            self._resolving.discard(dep_callable)
+    async def _call_async_gen(
+        self,
+        call: Callable[..., Any],
+        args: List[Any],
+        kwargs: Dict[str, Any],
+        ctx: ResolveContext,
+    ):
+        return await ctx.exit_stack.enter_async_context(call(*args, **kwargs))
+
+    async def _call_gen(
+        self,
+        call: Callable[..., Any],
+        args: List[Any],
+        kwargs: Dict[str, Any],
+        ctx: ResolveContext,
+    ):
+        return await ctx.exit_stack.enter_async_context(
+            contextmanager_in_threadpool(call(*args, **kwargs))
+        )
+
+    async def _call_plain(
+        self,
+        call: Callable[..., Any],
+        args: List[Any],
+        kwargs: Dict[str, Any],
+        ctx: ResolveContext,
+    ):
+        return await run_in_threadpool(call, *args, **kwargs)
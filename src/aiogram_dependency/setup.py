@@ -23,7 +23,13 @@ def setup_dependency(
 
     for allowed_update in allowed_updates or dispatcher.resolve_used_update_types():
         observer: TelegramEventObserver = getattr(dispatcher, allowed_update)
-        observer.middleware(DependencyMiddleware(registry))
+        middleware = DependencyMiddleware(registry)
+        observer.middleware(middleware)
+
+        # Build plans of registered handlers now, so circular dependencies fail at startup
+        for router in dispatcher.chain_tail:
+            for handler in router.observers[allowed_update].handlers:
+                middleware.resolver.get_plan(handler.callback)
 
     # Add shutdown hooks to properly close openend context in singletone cache
     async def on_shutdown():
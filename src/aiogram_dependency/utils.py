@@ -1,7 +1,8 @@
-from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextlib import asynccontextmanager
 import functools
 import asyncio
 import inspect
+from weakref import WeakKeyDictionary
 from typing import (
     Annotated,
     Any,
@@ -11,6 +12,7 @@ from typing import (
     ParamSpec,
     TypeVar,
     ContextManager,
+    Optional,
     get_args,
     get_origin,
 )
@@ -27,7 +29,6 @@ _P = ParamSpec("_P")
 
 
 async def run_in_threadpool(func: Callable[_P, _T], *args: _P.args, **kwargs: _P.kwargs) -> _T:
-    func = functools.partial(func, *args, **kwargs)
     return await asyncio.to_thread(func, *args, **kwargs)
 
 
@@ -67,20 +68,27 @@ def is_gen_callable(func: Callable[..., Any]) -> bool:
     return inspect.isgeneratorfunction(dunder_call)
 
 
-async def solve_generator(
-    *, call: Callable[..., Any], stack: AsyncExitStack, kwargs: Dict[str, Any]
-) -> Any:
-    if is_gen_callable(call):
-        cm = contextmanager_in_threadpool(contextmanager(call)(**kwargs))
-    elif is_async_gen_callable(call):
-        cm = asynccontextmanager(call)(**kwargs)
-    return await stack.enter_async_context(cm)
+# Weak keys, so a cached signature never keeps its callable (or the plan keyed by it) alive
+_signatures: WeakKeyDictionary[Callable, inspect.Signature] = WeakKeyDictionary()
 
 
-def extract_handler_signature(data: Dict[str, Any]) -> inspect.Signature:
+def get_signature(call: Callable[..., Any]) -> inspect.Signature:
+    # Signature objects are immutable, so one instance can be shared by every update
+    try:
+        signature = _signatures.get(call)
+    except TypeError:
+        # Unhashable or non-weakrefable callables (e.g. dataclass instances with __call__)
+        return inspect.signature(call)
+    if signature is None:
+        signature = inspect.signature(call)
+        _signatures[call] = signature
+    return signature
+
+
+def extract_handler_callback(data: Dict[str, Any]) -> Callable[..., Any]:
     handler = data.get("handler")
     if hasattr(handler, "callback"):
-        return inspect.signature(getattr(handler, "callback"))
+        return getattr(handler, "callback")
     raise ValueError("Callable not found")
 
 
@@ -94,20 +102,37 @@ def _extract_fastapi_scope(dependency: FastAPIDependency):
     return Scope.REQUEST
 
 
-def _as_fastapi_dependency(obj: Any):
+def _as_fastapi_dependency(obj: Any) -> Optional[Dependency]:
     if FastAPIDependency is not None and isinstance(obj, FastAPIDependency):
         return Dependency(dependency=obj.dependency, scope=_extract_fastapi_scope(obj))
-    return False
-
-
-def extract_dependency(param: inspect.Parameter) -> Dependency | bool:
-    if get_origin(param.annotation) is Annotated:
-        for meta in get_args(param.annotation)[1:]:
-            if isinstance(meta, Dependency):
-                return meta
-            else:
-                return _as_fastapi_dependency(meta)
-    elif isinstance(param.default, Dependency):
-        return param.default
-    else:
-        return _as_fastapi_dependency(param.default)
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_annotation_metadata(annotation: Any) -> tuple:
+    if get_origin(annotation) is Annotated:
+        return get_args(annotation)[1:]
+    return ()
+
+
+def _annotation_metadata(annotation: Any) -> tuple:
+    # The same Annotated alias is usually shared by many handlers and dependencies
+    try:
+        return _cached_annotation_metadata(annotation)
+    except TypeError:
+        # Unhashable metadata can't be cached
+        return _cached_annotation_metadata.__wrapped__(annotation)
+
+
+def extract_dependency(param: inspect.Parameter) -> Optional[Dependency]:
+    # Annotated metadata takes precedence over the default value
+    candidates = _annotation_metadata(param.annotation) + (param.default,)
+
+    dependency_cls = Dependency
+    for candidate in candidates:
+        if isinstance(candidate, dependency_cls):
+            return candidate
+        dependency = _as_fastapi_dependency(candidate)
+        if dependency is not None:
+            return dependency
+    return None
@@ -1,6 +1,13 @@
 import pytest
 from aiogram_dependency.dependency import Depends, Scope
-from aiogram.types import User, Chat, Message
+from aiogram_dependency.registry import (
+    CHAT_KEY,
+    GLOBAL_CACHE_KEY,
+    MISSING,
+    USER_KEY,
+    DependencyRegistry,
+)
+from aiogram.types import User, Chat, Message, TelegramObject
 from unittest.mock import Mock
 
 
@@ -33,9 +40,9 @@ def empty_message():
 @pytest.mark.parametrize(
     "messages, key",
     [
-        (message_with_user(), "user_123"),
-        (message_with_chat(), "chat_456"),
-        (empty_message(), "global"),
+        (message_with_user(), (USER_KEY, 123)),
+        (message_with_chat(), (CHAT_KEY, 456)),
+        (empty_message(), GLOBAL_CACHE_KEY),
     ],
 )
 def test_cache_generation_with_params(messages, key, registry):
@@ -43,12 +50,24 @@ def test_cache_generation_with_params(messages, key, registry):
     assert cache_key == key
 
 
+def test_cache_key_checked_per_instance(registry):
+    class CustomEvent(TelegramObject):
+        pass
+
+    # Extra fields are allowed, so instances of one type differ in cache key attributes
+    with_chat = CustomEvent(chat=Chat(id=456, type="private"))
+    without_chat = CustomEvent()
+
+    assert registry.get_cache_key(with_chat) == (CHAT_KEY, 456)
+    assert registry.get_cache_key(without_chat) == GLOBAL_CACHE_KEY
+
+
 @pytest.mark.parametrize(
     "value, cache_key, scope",
     [
-        ("test_value", "test_key", Scope.SINGLETON),
-        ("test_value", "user_123", Scope.REQUEST),
-        (None, "test_key", Scope.TRANSIENT),
+        ("test_value", GLOBAL_CACHE_KEY, Scope.SINGLETON),
+        ("test_value", (USER_KEY, 123), Scope.REQUEST),
+        (None, (USER_KEY, 123), Scope.REQUEST),
     ],
 )
 def test_cache_storage_and_retrieval(value, cache_key, scope, registry):
@@ -62,6 +81,17 @@ def test_cache_storage_and_retrieval(value, cache_key, scope, registry):
     assert retrived == value
 
 
+def test_transient_and_missing_values_are_not_cached(registry):
+    def dummy_dep():
+        return None
+
+    transient = Depends(dummy_dep, scope=Scope.TRANSIENT)
+    registry.set_dependency(transient, "test_value", GLOBAL_CACHE_KEY)
+
+    assert registry.get_dependency(transient, GLOBAL_CACHE_KEY) is MISSING
+    assert registry.get_dependency(Depends(dummy_dep), GLOBAL_CACHE_KEY) is MISSING
+
+
 def test_request_cache_isolation(registry):
     def dummy_dep():
         return "request_value"
@@ -71,8 +101,50 @@ def test_request_cache_isolation(registry):
     value1 = "value_for_user_1"
     value2 = "value_for_user_2"
 
-    registry.set_dependency(dependency, value1, "user_1")
-    registry.set_dependency(dependency, value2, "user_2")
+    registry.set_dependency(dependency, value1, (USER_KEY, 1))
+    registry.set_dependency(dependency, value2, (USER_KEY, 2))
+
+    assert registry.get_dependency(dependency, (USER_KEY, 1)) == value1
+    assert registry.get_dependency(dependency, (USER_KEY, 2)) == value2
+
+
+@pytest.mark.parametrize("scope", [Scope.SINGLETON, Scope.REQUEST, Scope.TRANSIENT])
+def test_bound_accessors_match_registry(scope, registry):
+    def dummy_dep():
+        return "value"
+
+    dependency = Depends(dummy_dep, scope=scope)
+    get_cached, set_cached = registry.bind(dependency)
+
+    set_cached("value", (USER_KEY, 1))
+    assert get_cached((USER_KEY, 1)) == registry.get_dependency(dependency, (USER_KEY, 1))
+
+    # Bound accessors see resets of the registry caches
+    registry.reset_request_cache()
+    registry.reset_singletone_cache()
+    assert get_cached((USER_KEY, 1)) is MISSING
+
+
+@pytest.mark.parametrize("scope", [Scope.SINGLETON, Scope.REQUEST])
+def test_bound_accessors_follow_replaced_caches(scope):
+    class ReplacingRegistry(DependencyRegistry):
+        def reset_request_cache(self):
+            self._request_cache = {}
+
+        def reset_singletone_cache(self):
+            self._singleton_cache = {}
+
+    def dummy_dep():
+        return "value"
+
+    registry = ReplacingRegistry()
+    dependency = Depends(dummy_dep, scope=scope)
+    get_cached, set_cached = registry.bind(dependency)
+
+    set_cached("value", (USER_KEY, 1))
+    registry.reset_request_cache()
+    registry.reset_singletone_cache()
+    assert get_cached((USER_KEY, 1)) is MISSING
 
-    assert registry.get_dependency(dependency, "user_1") == value1
-    assert registry.get_dependency(dependency, "user_2") == value2
+    set_cached("new value", (USER_KEY, 1))
+    assert registry.get_dependency(dependency, (USER_KEY, 1)) == "new value"
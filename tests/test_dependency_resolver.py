@@ -1,7 +1,14 @@
+import asyncio
+import functools
+import gc
+import time
+import weakref
+from typing import Annotated
 import pytest
 from aiogram.types import Message
 from aiogram_dependency.dependency import Depends, Scope
 from contextlib import AsyncExitStack
+from aiogram_dependency.resolver import ResolveContext
 
 
 @pytest.mark.asyncio
@@ -16,7 +23,8 @@ async def test_resolve_simple_dependency(resolver, mock_message, mock_data):
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
-        resolved = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
     assert resolved["service"] == "test_service"
 
 
@@ -36,36 +44,63 @@ async def test_resolve_nested_dependencies(resolver, mock_message, mock_data):
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
-        resolved = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     assert resolved["user_service"] == "user_service_with_database_connection"
 
 
-# @pytest.mark.asyncio
-# async def test_circular_dependency_detection(resolver, mock_message, mock_data):
-#     # Create circular dependencies
+@pytest.mark.asyncio
+async def test_circular_dependency_detection(resolver, mock_message, mock_data):
+    # Create circular dependencies, dep_b is attached once it is defined
+    dep_b_marker = Depends()
+
+    def dep_a(b=dep_b_marker):
+        return f"a_with_{b}"
+
+    def dep_b(a=Depends(dep_a)):
+        return f"b_with_{a}"
+
+    dep_b_marker.dependency = dep_b
 
+    async def test_handler(event: Message, service_a: str = Depends(dep_a)):
+        return service_a
 
-#     def dep_a(b = Depends(dep_b)):
-#         return f"a_with_{b}"
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        with pytest.raises(ValueError, match="dep_a -> dep_b -> dep_a"):
+            await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
-#     def dep_b(a=Depends(dep_a)):
-#         return f"b_with_{a}"
 
-#     async def test_handler(
-#         event: Message,
-#         service_a: str = Depends(dep_a)
-#     ):
-#         return service_a
+@pytest.mark.asyncio
+async def test_concurrent_resolves_do_not_share_state(resolver, mock_message, mock_data):
+    release = asyncio.Event()
+
+    async def get_slow_service():
+        await release.wait()
+        return "slow_service"
+
+    async def test_handler(
+        event: Message, service: str = Depends(get_slow_service, scope=Scope.TRANSIENT)
+    ):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
 
-#     setattr(mock_data['handler'], 'callback', test_handler)
+    async def resolve():
+        async with AsyncExitStack() as exit_stack:
+            ctx = ResolveContext(exit_stack)
+            return await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
 
+    # Both updates are resolving the same dependency at the same time
+    tasks = asyncio.gather(resolve(), resolve())
+    await asyncio.sleep(0)
+    release.set()
+    resolved1, resolved2 = await tasks
 
-#     resolved = await resolver.resolve_dependencies(mock_message, mock_data)
-#     print(resolved['service_a'])
-#     assert False
-#     # with pytest.raises(ValueError):
-#     #     await resolver.resolve_dependencies(mock_message, mock_data)
+    assert resolved1["service"] == resolved2["service"] == "slow_service"
 
 
 @pytest.mark.asyncio
@@ -87,9 +122,10 @@ async def test_dependency_caching_singleton(resolver, mock_message, mock_data):
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     # Should be called only once due to singleton caching
     assert call_count == 1
@@ -114,9 +150,10 @@ async def test_dependency_caching_request(resolver, mock_message, mock_data):
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice with same message (same cache key)
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     # Should be called only once due to request caching
     assert call_count == 1
@@ -142,11 +179,392 @@ async def test_dependency_no_caching_transient(resolver, mock_message, mock_data
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
 
     # Should be called twice (no caching)
     assert call_count == 2
     assert resolved1["service"] == "transient_1"
     assert resolved2["service"] == "transient_2"
+
+
+@pytest.mark.asyncio
+async def test_handler_plan_is_cached(resolver, mock_message, mock_data):
+    def get_service_dep():
+        return "test_service"
+
+    async def test_handler(event: Message, service: str = Depends(get_service_dep)):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+        plan = resolver._handler_plans[test_handler]
+        await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+
+    assert resolver._handler_plans[test_handler] is plan
+    handler_ref, handler_plan = resolver._handler_object_plans[id(mock_data["handler"])]
+    assert handler_ref() is mock_data["handler"]
+    assert handler_plan is plan
+    assert [name for name, _ in plan.outputs] == ["service"]
+
+
+def test_handler_plan_is_released_with_callback(resolver):
+    def get_service_dep():
+        return "test_service"
+
+    async def test_handler(event: Message, service: str = Depends(get_service_dep)):
+        return service
+
+    resolver.get_plan(test_handler)
+    handler_ref = weakref.ref(test_handler)
+    del test_handler
+    gc.collect()
+
+    assert handler_ref() is None
+    assert len(resolver._handler_plans) == 0
+
+
+@pytest.mark.asyncio
+async def test_resolve_annotated_dependency_after_other_metadata(resolver, mock_message, mock_data):
+    def get_service_dep():
+        return "test_service"
+
+    async def test_handler(
+        event: Message, service: Annotated[str, "docs", Depends(get_service_dep)]
+    ):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+    assert resolved["service"] == "test_service"
+
+
+@pytest.mark.asyncio
+async def test_dependency_caching_none_value(resolver, mock_message, mock_data):
+    call_count = 0
+
+    def get_optional_service():
+        nonlocal call_count
+        call_count += 1
+        return None
+
+    async def test_handler(event: Message, service: str = Depends(get_optional_service)):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    # None is a legitimate cached value, not a cache miss
+    assert call_count == 1
+    assert resolved1["service"] is resolved2["service"] is None
+
+
+@pytest.mark.asyncio
+async def test_dependency_receives_event_and_data_params(resolver, mock_message, mock_data):
+    def get_context(event, data, bot, missing="default"):
+        return event, data, bot, missing
+
+    async def test_handler(event: Message, context: tuple = Depends(get_context)):
+        return context
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["context"] == (mock_message, mock_data, mock_data["bot"], "default")
+
+
+@pytest.mark.asyncio
+async def test_transient_dependency_called_per_usage(resolver, mock_message, mock_data):
+    call_count = 0
+
+    def get_transient_service():
+        nonlocal call_count
+        call_count += 1
+        return f"transient_{call_count}"
+
+    def get_consumer(service: str = Depends(get_transient_service, scope=Scope.TRANSIENT)):
+        return service
+
+    async def test_handler(
+        event: Message,
+        service: str = Depends(get_transient_service, scope=Scope.TRANSIENT),
+        consumer: str = Depends(get_consumer),
+    ):
+        return service, consumer
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert call_count == 2
+    assert {resolved["service"], resolved["consumer"]} == {"transient_1", "transient_2"}
+
+
+@pytest.mark.asyncio
+async def test_cached_dependency_skips_nested(resolver, mock_message, mock_data):
+    call_count = 0
+
+    def get_config():
+        nonlocal call_count
+        call_count += 1
+        return "config"
+
+    def get_engine(config: str = Depends(get_config, scope=Scope.TRANSIENT)):
+        return f"engine_with_{config}"
+
+    async def test_handler(
+        event: Message, engine: str = Depends(get_engine, scope=Scope.SINGLETON)
+    ):
+        return engine
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+
+    assert call_count == 1
+    assert resolved["engine"] == "engine_with_config"
+
+
+@pytest.mark.asyncio
+async def test_independent_dependencies_resolve_concurrently(resolver, mock_message, mock_data):
+    first_started = asyncio.Event()
+    second_started = asyncio.Event()
+
+    # Each dependency waits for the other one, so sequential resolving would hang
+    async def get_first():
+        first_started.set()
+        await second_started.wait()
+        return "first"
+
+    async def get_second():
+        second_started.set()
+        await first_started.wait()
+        return "second"
+
+    async def test_handler(
+        event: Message,
+        first: str = Depends(get_first),
+        second: str = Depends(get_second),
+    ):
+        return first, second
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await asyncio.wait_for(
+            resolver.resolve_dependencies(mock_message, mock_data, ctx), timeout=1
+        )
+
+    assert resolved["first"] == "first"
+    assert resolved["second"] == "second"
+
+
+@pytest.mark.asyncio
+async def test_sync_sibling_dependencies_do_not_overlap(resolver, mock_message, mock_data):
+    finished = []
+
+    def get_slow():
+        time.sleep(0.05)
+        finished.append("slow")
+        return "slow"
+
+    def get_fast():
+        finished.append("fast")
+        return "fast"
+
+    async def test_handler(
+        event: Message,
+        slow: str = Depends(get_slow),
+        fast: str = Depends(get_fast),
+    ):
+        return slow, fast
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert finished == ["slow", "fast"]
+    assert resolved["slow"] == "slow"
+    assert resolved["fast"] == "fast"
+
+
+@pytest.mark.asyncio
+async def test_dependency_receives_earlier_handler_dependency(resolver, mock_message, mock_data):
+    def get_database():
+        return "database_connection"
+
+    def get_repository(database):
+        return f"repository_with_{database}"
+
+    async def test_handler(
+        event: Message,
+        database: str = Depends(get_database),
+        repository: str = Depends(get_repository),
+    ):
+        return repository
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["repository"] == "repository_with_database_connection"
+
+
+@pytest.mark.asyncio
+async def test_dependency_with_positional_only_and_variadic_params(
+    resolver, mock_message, mock_data
+):
+    def get_database():
+        return "database_connection"
+
+    def get_service(db: str = Depends(get_database), /, *args, **kwargs):
+        return db, args, kwargs
+
+    async def test_handler(event: Message, service: tuple = Depends(get_service)):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["service"] == ("database_connection", (), {})
+
+
+@pytest.mark.asyncio
+async def test_sibling_dependency_may_return_exception_object(resolver, mock_message, mock_data):
+    error = ValueError("not raised")
+
+    async def get_error():
+        return error
+
+    async def get_service():
+        return "service"
+
+    async def test_handler(
+        event: Message,
+        error_value: ValueError = Depends(get_error),
+        service: str = Depends(get_service),
+    ):
+        return error_value, service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["error_value"] is error
+    assert resolved["service"] == "service"
+
+
+@pytest.mark.asyncio
+async def test_sibling_dependency_error_is_raised(resolver, mock_message, mock_data):
+    async def get_failing():
+        raise ValueError("dependency failed")
+
+    async def get_service():
+        return "service"
+
+    async def test_handler(
+        event: Message,
+        failing: str = Depends(get_failing),
+        service: str = Depends(get_service),
+    ):
+        return failing, service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        with pytest.raises(ValueError, match="dependency failed"):
+            await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+
+@pytest.mark.asyncio
+async def test_dependency_with_positional_only_data_params(resolver, mock_message, mock_data):
+    def get_context(bot, missing="default", /, event=None):
+        return bot, missing, event
+
+    async def test_handler(event: Message, context: tuple = Depends(get_context)):
+        return context
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["context"] == (mock_data["bot"], "default", mock_message)
+
+
+@pytest.mark.asyncio
+async def test_dependency_with_missing_positional_only_data_param(
+    resolver, mock_message, mock_data
+):
+    def get_service(unknown, /):
+        return unknown
+
+    async def test_handler(event: Message, service: str = Depends(get_service)):
+        return service
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        with pytest.raises(TypeError, match="positional-only parameter 'unknown'"):
+            await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+
+@pytest.mark.asyncio
+async def test_wrapped_dependency_with_keyword_only_wrapper(resolver, mock_message, mock_data):
+    def keyword_only(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            return await func(**kwargs)
+
+        return wrapper
+
+    def get_database():
+        return "database_connection"
+
+    @keyword_only
+    async def get_repository(event, database: str = Depends(get_database)):
+        return "repository", database
+
+    async def test_handler(event: Message, repository: tuple = Depends(get_repository)):
+        return repository
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+
+    assert resolved["repository"] == ("repository", "database_connection")
@@ -1,6 +1,7 @@
 import pytest
 from aiogram.types import Message
 from contextlib import AsyncExitStack
+from aiogram_dependency.resolver import ResolveContext
 from fastapi import Depends
 
 
@@ -16,7 +17,8 @@ async def test_resolve_simple_fastapi_dependency(resolver, mock_message, mock_da
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
-        resolved = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
     assert resolved["service"] == "test_service"
 
 
@@ -36,7 +38,8 @@ async def test_resolve_nested_fastapi_dependencies(resolver, mock_message, mock_
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
-        resolved = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        ctx = ResolveContext(exit_stack)
+        resolved = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     assert resolved["user_service"] == "user_service_with_database_connection"
 
@@ -60,9 +63,10 @@ async def test_fastapi_dependency_caching_singleton(resolver, mock_message, mock
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     # Should be called only once due to singleton caching
     assert call_count == 1
@@ -87,9 +91,10 @@ async def test_fastapi_dependency_caching_request(resolver, mock_message, mock_d
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice with same message (same cache key)
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data, ctx)
 
     # Should be called only once due to request caching
     assert call_count == 1
@@ -115,9 +120,10 @@ async def test_fastapi_dependency_no_caching_transient(resolver, mock_message, m
     setattr(mock_data["handler"], "callback", test_handler)
 
     async with AsyncExitStack() as exit_stack:
+        ctx = ResolveContext(exit_stack)
         # Resolve twice
-        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), exit_stack)
-        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), exit_stack)
+        resolved1 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
+        resolved2 = await resolver.resolve_dependencies(mock_message, mock_data.copy(), ctx)
 
     # Should be called twice (no caching)
     assert call_count == 2
@@ -106,3 +106,40 @@ async def test_middleware_skips_non_dependency_params(middleware, mock_message,
     # No dependencies should be added
     assert mock_data == original_data
     assert result == "result"
+
+
+@pytest.mark.asyncio
+async def test_generator_dependencies_teardown_lifo_after_handler(
+    middleware, mock_message, mock_data
+):
+    events = []
+
+    async def get_first():
+        events.append("enter_first")
+        yield "first"
+        events.append("exit_first")
+
+    def get_second(first: str = Depends(get_first)):
+        events.append("enter_second")
+        yield "second"
+        events.append("exit_second")
+
+    async def test_handler(event: Message, second: str = Depends(get_second)):
+        return second
+
+    setattr(mock_data["handler"], "callback", test_handler)
+
+    async def handler(event, data):
+        events.append("handler")
+        return data["second"]
+
+    result = await middleware(handler, mock_message, mock_data)
+
+    assert result == "second"
+    assert events == [
+        "enter_first",
+        "enter_second",
+        "handler",
+        "exit_second",
+        "exit_first",
+    ]
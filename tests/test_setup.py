@@ -0,0 +1,28 @@
+import pytest
+from aiogram import Dispatcher, Router
+from aiogram.types import Message
+from aiogram_dependency import Depends, setup_dependency
+
+
+def test_setup_rejects_circular_dependencies():
+    # Create circular dependencies, dep_b is attached once it is defined
+    dep_b_marker = Depends()
+
+    def dep_a(b=dep_b_marker):
+        return f"a_with_{b}"
+
+    def dep_b(a=Depends(dep_a)):
+        return f"b_with_{a}"
+
+    dep_b_marker.dependency = dep_b
+
+    async def test_handler(event: Message, service_a: str = Depends(dep_a)):
+        return service_a
+
+    dispatcher = Dispatcher()
+    router = Router()
+    router.message.register(test_handler)
+    dispatcher.include_router(router)
+
+    with pytest.raises(ValueError, match="dep_a -> dep_b -> dep_a"):
+        setup_dependency(dispatcher)